@@ -1,23 +1,31 @@
 # File: app.py
+import hashlib
 import os
+import threading
 import uuid
 import numpy as np
 import sys
 from pathlib import Path
 
 from flask import Flask, request, jsonify, send_from_directory
+from flask.json.provider import JSONProvider
 from flask_cors import CORS  # Add this import
 from werkzeug.utils import secure_filename
 import cv2
+import orjson
 
 # Import your floorplan code
 from detect_floorplan import (
-    skeletonize_image,
-    detect_corners,
-    cluster_points,
-    detect_straight_walls_hough,
-    fit_line_to_clustered_points
+    skeletonize_gray,
+    scale_coordinates,
+    MAX_IMAGE_SIDE,
+    SKELETON_CACHE_VERSION,
+    THINNING_BACKEND,
+    fit_line_to_clustered_points,
+    draw_lines
 )
+from caching import BoundedMemory
+from pipeline import PipelinePool
 
 # Add path to FloorplanTransformation
 FLOORPLAN_TRANSFORM_PATH = Path(__file__).parent.parent / "FloorplanTransformation"
@@ -25,7 +33,18 @@ sys.path.append(str(FLOORPLAN_TRANSFORM_PATH))
 # Fix: Rename the imported function to avoid naming conflict
 from run_floorplan import process_floorplan as ai_process_floorplan
 
+class ORJSONProvider(JSONProvider):
+    """
+    JSON provider backed by orjson, which also serializes NumPy arrays directly.
+    """
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 CORS(app, resources={
     r"/*": {
         "origins": "*",
@@ -38,11 +57,61 @@ CORS(app, resources={
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# On-disk skeleton cache: re-running the same image with different clusters
+# (or the same thresh_val) skips decoding and skeletonization. It sits on the
+# uploads volume, so its size is capped; override with SKELETON_CACHE_BYTES
+SKELETON_CACHE_BYTES = int(os.environ.get('SKELETON_CACHE_BYTES', 512 * 1024 * 1024))
+skel_memory = BoundedMemory(os.path.join(UPLOAD_FOLDER, '.skel_cache'), bytes_limit=SKELETON_CACHE_BYTES)
+
+# Part of every cache key: skeletons differ between code versions and thinning backends
+SKELETON_CACHE_KEY = f"v{SKELETON_CACHE_VERSION}-{THINNING_BACKEND}"
+
+@skel_memory.cache(ignore=['image_bytes'])
+def cached_skeleton(content_hash, thresh_val, target_side, cache_key, image_bytes):
+    """
+    Decodes and skeletonizes an uploaded image, cached on disk by
+    (content_hash, thresh_val, target_side, cache_key); the raw bytes are not
+    hashed again. Returns (skeleton, scale) as skeletonize_gray does.
+    """
+    gray = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise ValueError("Could not decode the uploaded image")
+    return skeletonize_gray(gray, thresh_val=thresh_val, target_side=target_side)
+
+# On-disk KMeans cache: sweeping thresh_val/clusters over the same image
+# produces the same corner set, so cluster centers only need fitting once
+KMEANS_CACHE_DIR = os.path.join(UPLOAD_FOLDER, '.kmeans_cache')
+
+# Pre-warmed processes for the corner/cluster/Hough stages; started by
+# gunicorn's post_worker_init hook, or by the first request otherwise
+pipeline_pool = PipelinePool(kmeans_cache_dir=KMEANS_CACHE_DIR)
+
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp', 'tiff'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Per-thread BGR scratch buffers for annotating skeletons, keyed by shape
+_bgr_pool = threading.local()
+BGR_POOL_MAX_SHAPES = 4
+
+def skeleton_to_bgr(skel):
+    """
+    Copies a grayscale skeleton into this thread's reusable BGR buffer.
+    The buffer is overwritten by the next call from the same thread.
+    """
+    buffers = getattr(_bgr_pool, 'buffers', None)
+    if buffers is None:
+        buffers = _bgr_pool.buffers = {}
+
+    bgr = buffers.get(skel.shape)
+    if bgr is None:
+        if len(buffers) >= BGR_POOL_MAX_SHAPES:
+            buffers.clear()
+        bgr = buffers[skel.shape] = np.empty(skel.shape + (3,), dtype=np.uint8)
+    cv2.merge([skel, skel, skel], dst=bgr)
+    return bgr
+
 @app.route('/')
 def index():
     return "Hello! Flask is running, and I'm ready to process floorplan images."
@@ -60,7 +129,9 @@ def process_floorplan():
       - 'image': File upload
       - 'thresh_val': optional int
       - 'clusters': optional int
-    Returns JSON with corners, lines, etc. plus an annotated image path.
+      - 'target_side': optional int, max processed side length (0 = full resolution)
+    Returns JSON with corners, lines, etc. plus an annotated image path, and
+    the annotated image's `scale` relative to the upload.
     """
     if 'image' not in request.files:
         return jsonify({"error": "No file part named 'image' in request"}), 400
@@ -72,73 +143,58 @@ def process_floorplan():
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
         unique_filename = f"{uuid.uuid4()}_{filename}"
-        filepath = os.path.join(UPLOAD_FOLDER, unique_filename)
-        file.save(filepath)
+
+        # Process straight from the upload; only the annotated result is written to disk
+        image_bytes = file.stream.read()
+        content_hash = hashlib.sha1(image_bytes).hexdigest()
 
         # Parse optional form params
         thresh_val = int(request.form.get('thresh_val', 100))
         clusters = int(request.form.get('clusters', 20))
+        target_side = int(request.form.get('target_side', MAX_IMAGE_SIDE))
+        if target_side < 0:
+            return jsonify({"error": "target_side must be a non-negative integer"}), 400
         
-        # 1. Skeletonize
+        # 1. Skeletonize (large scans are downscaled first); cached per image content
         try:
-            skel = skeletonize_image(filepath, thresh_val=thresh_val)
+            skel, scale = cached_skeleton(content_hash, thresh_val, target_side, SKELETON_CACHE_KEY, image_bytes)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         except Exception as e:
             return jsonify({"error": f"Skeletonization failed: {str(e)}"}), 500
+        skel_memory.maybe_trim()
         
-        # 2. Detect corners
+        # 2-4. Detect corners, cluster them and find Hough lines in the worker pool
         try:
-            corners = detect_corners(skel, max_corners=500, quality_level=0.001, min_distance=10)
+            corners, clustered_pts, lines = pipeline_pool.run(skel, num_clusters=clusters)
         except Exception as e:
-            return jsonify({"error": f"Corner detection failed: {str(e)}"}), 500
-
-        # 3. Cluster corners
-        try:
-            clustered_pts = cluster_points(corners, num_clusters=clusters)
-        except Exception as e:
-            return jsonify({"error": f"Clustering failed: {str(e)}"}), 500
-
-        # 4. Hough lines
-        try:
-            lines = detect_straight_walls_hough(skel)
-            if lines is None:
-                lines_list = []
-            else:
-                lines_list = lines.tolist()  # convert to normal Python list
-        except Exception as e:
-            return jsonify({"error": f"Hough Transform failed: {str(e)}"}), 500
+            return jsonify({"error": str(e)}), 500
 
         # 5. Annotate skeleton
         try:
-            skel_bgr = cv2.cvtColor(skel, cv2.COLOR_GRAY2BGR)
+            skel_bgr = skeleton_to_bgr(skel)
             fit_line_to_clustered_points(skel_bgr, clustered_pts, draw=True)
 
             # Draw lines in green
-            for line in lines_list:
-                x1, y1, x2, y2 = line
-                cv2.line(skel_bgr, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
+            draw_lines(skel_bgr, lines)
 
             # Save annotated image
             clustered_filename = f"{unique_filename}_annotated.png"
             clustered_path = os.path.join(UPLOAD_FOLDER, clustered_filename)
-            cv2.imwrite(clustered_path, skel_bgr)
+            cv2.imwrite(clustered_path, skel_bgr, [cv2.IMWRITE_PNG_COMPRESSION, 3])
         except Exception as e:
             return jsonify({"error": f"Annotation failed: {str(e)}"}), 500
 
-        # 6. Convert corners & clustered_pts & lines to plain Python ints
-        # so jsonify won't complain about np.int64
-        corners_py = [[int(x), int(y)] for (x, y) in corners]
-        clustered_pts_py = [[int(x), int(y)] for (x, y) in clustered_pts]
-        lines_list_py = [
-            [int(x1), int(y1), int(x2), int(y2)]
-            for (x1, y1, x2, y2) in lines_list
-        ]
-
+        # 6. Report coordinates at the uploaded image's resolution; orjson
+        # serializes the int32 ndarrays as-is (see ORJSONProvider). The
+        # annotated image stays at the processed resolution, hence `scale`
         return jsonify({
             "status": "success",
-            "corners": corners_py,
-            "clusteredPoints": clustered_pts_py,
-            "lines": lines_list_py,
-            "clusteredImagePath": f"uploads/{clustered_filename}"
+            "corners": scale_coordinates(corners, scale),
+            "clusteredPoints": scale_coordinates(clustered_pts, scale),
+            "lines": scale_coordinates(lines, scale),
+            "clusteredImagePath": f"uploads/{clustered_filename}",
+            "scale": scale
         })
 
     else:
@@ -273,5 +329,5 @@ def transform_floorplan():
     return jsonify({"error": "Unsupported file extension"}), 400
 
 if __name__ == '__main__':
-    # Start dev server
-    app.run(debug=True, host='0.0.0.0', port=5000, threaded=True)
+    # Local development only; production runs under gunicorn (see gunicorn.conf.py)
+    app.run(host='0.0.0.0', port=5000, threaded=True)
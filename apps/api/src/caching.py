@@ -0,0 +1,35 @@
+# File: caching.py
+import threading
+import time
+
+from joblib import Memory
+
+# Minimum seconds between two size checks of the same cache
+CACHE_TRIM_INTERVAL = 300
+
+class BoundedMemory:
+    """
+    Compressed joblib Memory kept under `bytes_limit` bytes on disk.
+    Call maybe_trim() after storing results; it evicts least recently
+    used entries at most once every CACHE_TRIM_INTERVAL seconds.
+    """
+    def __init__(self, location, bytes_limit, compress=3):
+        self.memory = Memory(location=location, compress=compress, verbose=0)
+        self.bytes_limit = bytes_limit
+        self._last_trim = float('-inf')
+        self._lock = threading.Lock()
+
+    def cache(self, func=None, **kwargs):
+        return self.memory.cache(func, **kwargs)
+
+    def maybe_trim(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_trim < CACHE_TRIM_INTERVAL:
+                return
+            self._last_trim = now
+        try:
+            self.memory.reduce_size(bytes_limit=self.bytes_limit)
+        except OSError:
+            # Another process may be trimming the same cache concurrently
+            pass
@@ -19,158 +19,427 @@ except ImportError:
     SKIMAGE_AVAILABLE = False
     sk_skeletonize = None  # for safety
 
-from sklearn.cluster import KMeans
+# Faster fallback than skimage: Numba-compiled Guo-Hall thinning
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# Optional: FAISS k-means (BLAS distance computation) for large clustering problems
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+from scipy.cluster.vq import kmeans2
+from scipy.spatial import cKDTree
+
+# 3×3 structuring element for the open/close denoising in skeletonize_gray
+_KERNEL3 = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+
+def _build_disk_offsets(radius=3):
+    """
+    (dy, dx) offsets of the pixels cv2.circle fills for a dot of the given radius.
+    """
+    size = 2 * radius + 1
+    stamp = np.zeros((size, size), dtype=np.uint8)
+    cv2.circle(stamp, (radius, radius), radius, 255, -1)
+    return np.argwhere(stamp) - radius
+
+DISK_OFFSETS = _build_disk_offsets()
+
+# skeletonize_gray downscales images whose longest side exceeds this
+MAX_IMAGE_SIDE = 1200
+
+# Bump whenever skeletonize_gray or morphological_thinning change their output,
+# so skeletons cached on disk by earlier code are not served again
+SKELETON_CACHE_VERSION = 1
+
+# Let OpenCV's transparent API run on OpenCL when a device is present. Without
+# one, wrapping images in UMat only adds overhead, so plain ndarrays are used.
+cv2.ocl.setUseOpenCL(True)
+OPENCL_AVAILABLE = cv2.ocl.haveOpenCL() and cv2.ocl.useOpenCL()
+
+# cluster_points hands problems with at least this many points × clusters to FAISS
+FAISS_MIN_WORK = 100_000
+
+# (dy, dx) of the 8 neighbours in the clockwise order used by classify_point:
+# N, NE, E, SE, S, SW, W, NW. Bit i of a neighbour code is neighbour i.
+NEIGHBOR_OFFSETS = (
+    (-1, 0), (-1, 1), (0, 1), (1, 1),
+    (1, 0), (1, -1), (0, -1), (-1, -1)
+)
+
+# Point categories, indices into POINT_TYPES
+CATEGORY_NONE, CATEGORY_ENDPOINT, CATEGORY_CORNER, CATEGORY_T_JUNCTION = range(4)
+POINT_TYPES = ('none', 'endpoint', 'corner', 't_junction')
+CATEGORY_COLORS = np.array([
+    (0, 165, 255),  # Orange = none
+    (255, 0, 0),    # Blue = endpoint
+    (0, 0, 255),    # Red = corner
+    (0, 255, 0),    # Green = T-junction
+], dtype=np.uint8)
+
+def _build_neighbor_luts():
+    """
+    Precomputes, for every 8-bit neighbour code, the number of set neighbours,
+    the number of 0->1 transitions (with wrap-around) and the resulting
+    category of a foreground center pixel.
+    """
+    neighbor_count_lut = np.zeros(256, dtype=np.uint8)
+    transition_lut = np.zeros(256, dtype=np.uint8)
+    category_lut = np.full(256, CATEGORY_NONE, dtype=np.uint8)
+    for code in range(256):
+        bits = [(code >> i) & 1 for i in range(8)]
+        neighbors = sum(bits)
+        transitions = sum(1 for i in range(8) if bits[i] == 0 and bits[(i + 1) % 8] == 1)
+        neighbor_count_lut[code] = neighbors
+        transition_lut[code] = transitions
+
+        if neighbors == 1:
+            category_lut[code] = CATEGORY_ENDPOINT
+        elif transitions == 2:
+            if neighbors == 2:
+                category_lut[code] = CATEGORY_CORNER
+            elif neighbors == 3:
+                category_lut[code] = CATEGORY_T_JUNCTION
+    return neighbor_count_lut, transition_lut, category_lut
+
+NEIGHBOR_COUNT_LUT, TRANSITION_LUT, CATEGORY_LUT = _build_neighbor_luts()
+
+def _build_guo_hall_luts():
+    """
+    Precomputes Guo-Hall deletion flags for both sub-iterations, indexed by a
+    9-bit code: bits 0-7 are the neighbours (as in NEIGHBOR_OFFSETS), bit 8 the center.
+    """
+    iter1_lut = np.zeros(512, dtype=np.uint8)
+    iter2_lut = np.zeros(512, dtype=np.uint8)
+    for code in range(256, 512):  # center pixel set
+        # p2..p9 = N, NE, E, SE, S, SW, W, NW
+        p2, p3, p4, p5, p6, p7, p8, p9 = [(code >> i) & 1 for i in range(8)]
+        c = (((1 - p2) & (p3 | p4)) + ((1 - p4) & (p5 | p6)) +
+             ((1 - p6) & (p7 | p8)) + ((1 - p8) & (p9 | p2)))
+        n1 = (p9 | p2) + (p3 | p4) + (p5 | p6) + (p7 | p8)
+        n2 = (p2 | p3) + (p4 | p5) + (p6 | p7) + (p8 | p9)
+        if c != 1 or not 2 <= min(n1, n2) <= 3:
+            continue
+        iter1_lut[code] = ((p6 | p7 | (1 - p9)) & p8) == 0
+        iter2_lut[code] = ((p2 | p3 | (1 - p5)) & p4) == 0
+    return iter1_lut, iter2_lut
+
+GUO_HALL_ITER1_LUT, GUO_HALL_ITER2_LUT = _build_guo_hall_luts()
+_NEIGHBOR_DY = np.array([dy for dy, _ in NEIGHBOR_OFFSETS], dtype=np.intp)
+_NEIGHBOR_DX = np.array([dx for _, dx in NEIGHBOR_OFFSETS], dtype=np.intp)
+
+if NUMBA_AVAILABLE:
+    # Serial on purpose: thinning runs in request threads, and Numba's default
+    # workqueue threading layer aborts the process on concurrent parallel calls
+    @njit(cache=True)
+    def _guo_hall_subiteration(img, marker, lut, dys, dxs):
+        """
+        Runs one Guo-Hall sub-iteration in place on a 0/1 image.
+        Returns the number of deleted pixels.
+        """
+        h, w = img.shape
+        for y in range(1, h - 1):
+            for x in range(1, w - 1):
+                marker[y, x] = 0
+                if img[y, x]:
+                    code = 256
+                    for b in range(8):
+                        code |= img[y + dys[b], x + dxs[b]] << b
+                    marker[y, x] = lut[code]
+
+        removed = 0
+        for y in range(1, h - 1):
+            for x in range(1, w - 1):
+                if marker[y, x]:
+                    img[y, x] = 0
+                    removed += 1
+        return removed
+
+def _numba_thinning(binary_img):
+    """
+    Guo-Hall thinning driven by GUO_HALL_ITER1_LUT/GUO_HALL_ITER2_LUT.
+    """
+    img = (binary_img > 0).astype(np.uint8)
+    marker = np.zeros_like(img)
+    while True:
+        removed = _guo_hall_subiteration(img, marker, GUO_HALL_ITER1_LUT, _NEIGHBOR_DY, _NEIGHBOR_DX)
+        removed += _guo_hall_subiteration(img, marker, GUO_HALL_ITER2_LUT, _NEIGHBOR_DY, _NEIGHBOR_DX)
+        if removed == 0:
+            break
+    img *= 255
+    return img
+
+# Thinning implementation used by morphological_thinning
+if XIMGPROC_AVAILABLE:
+    THINNING_BACKEND = 'ximgproc'
+elif NUMBA_AVAILABLE:
+    THINNING_BACKEND = 'numba'
+elif SKIMAGE_AVAILABLE:
+    THINNING_BACKEND = 'skimage'
+else:
+    THINNING_BACKEND = None
 
 def morphological_thinning(binary_img):
     """
-    Perform morphological thinning using either OpenCV's ximgproc.thinning 
-    or skimage's skeletonize as a fallback.
+    Perform morphological thinning using OpenCV's ximgproc.thinning, falling
+    back to Numba Guo-Hall thinning and then skimage's skeletonize.
     
     :param binary_img: Binary image (uint8, 0 or 255)
     :return: Thinned image (uint8, 0 or 255)
     """
-    print("[DEBUG] morphological_thinning input shape:", binary_img.shape)
     if XIMGPROC_AVAILABLE:
-        thinned = cv2.ximgproc.thinning(binary_img)
-        print("[DEBUG] morphological_thinning ximgproc output shape:", thinned.shape)
-        return thinned
+        return cv2.ximgproc.thinning(binary_img)
+
+    elif NUMBA_AVAILABLE:
+        return _numba_thinning(binary_img)
     
     elif SKIMAGE_AVAILABLE:
         bool_img = (binary_img > 0)
         skel = sk_skeletonize(bool_img)
-        thinned = (skel * 255).astype(np.uint8)
-        print("[DEBUG] morphological_thinning skimage output shape:", thinned.shape)
-        return thinned
+        return (skel * 255).astype(np.uint8)
     else:
-        raise ImportError("No available thinning method. Install opencv-contrib-python or scikit-image.")
+        raise ImportError("No available thinning method. Install opencv-contrib-python, numba or scikit-image.")
 
-def skeletonize_image(img_path, thresh_val=100):
+def skeletonize_image(img_path, thresh_val=100, target_side=MAX_IMAGE_SIDE):
     """
-    Reads a floorplan image, thresholds it, applies morphological denoising,
-    and then skeletonizes it using morphological thinning.
-    Returns the skeleton image (0 = background, 255 = foreground).
+    Reads a floorplan image from disk and skeletonizes it (see skeletonize_gray).
+    Returns (skeleton, scale).
     """
     # 1. Load image in grayscale
     gray = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
     if gray is None:
         raise ValueError(f"Could not open or find the image: {img_path}")
-    
+    return skeletonize_gray(gray, thresh_val=thresh_val, target_side=target_side)
+
+def skeletonize_gray(gray, thresh_val=100, target_side=MAX_IMAGE_SIDE):
+    """
+    Thresholds an already-decoded grayscale floorplan, applies morphological
+    denoising, and then skeletonizes it using morphological thinning.
+
+    Images whose longest side exceeds `target_side` are first downscaled to
+    it (a falsy `target_side` disables this); walls are many pixels thick,
+    so this loses nothing the skeleton needs.
+    Returns (skeleton, scale): the skeleton (0 = background, 255 = foreground)
+    at the processed resolution, and its scale relative to `gray`.
+    """
+    if target_side is not None and target_side < 0:
+        raise ValueError(f"target_side must be non-negative, got {target_side}")
     orig_height, orig_width = gray.shape[:2]
-    print(f"[DEBUG] Original (H×W): {orig_height} × {orig_width}")
+
+    # 1b. Downscale large scans
+    scale = 1.0
+    if target_side:
+        scale = min(1.0, target_side / max(orig_height, orig_width))
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
 
     # 2. Threshold
     _, binary = cv2.threshold(gray, thresh_val, 255, cv2.THRESH_BINARY_INV)
-    print("[DEBUG] After threshold shape:", binary.shape)
 
-    # 3. Morphological opening/closing
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
-    opened = cv2.morphologyEx(binary, cv2.MORPH_OPEN, kernel)
-    print("[DEBUG] After open shape:", opened.shape)
-    closed = cv2.morphologyEx(opened, cv2.MORPH_CLOSE, kernel)
-    print("[DEBUG] After close shape:", closed.shape)
+    # 3. Morphological opening/closing, ending back in `binary`
+    opened = np.empty_like(binary)
+    cv2.morphologyEx(binary, cv2.MORPH_OPEN, _KERNEL3, dst=opened)
+    cv2.morphologyEx(opened, cv2.MORPH_CLOSE, _KERNEL3, dst=binary)
 
     # 4. Thinning (skeletonization)
-    skel = morphological_thinning(closed)
-    print("[DEBUG] After thinning shape:", skel.shape)
-
-    # 5. Resize if needed
-    if (skel.shape[0] != orig_height) or (skel.shape[1] != orig_width):
-        print("[INFO] Resizing skeleton to match original.")
-        skel = cv2.resize(skel, (orig_width, orig_height), interpolation=cv2.INTER_NEAREST)
-    print("[DEBUG] Final skeleton shape:", skel.shape)
+    skel = morphological_thinning(binary)
 
     # Ensure skeleton is 0 or 255
     skel[skel > 0] = 255
 
-    return skel
+    return skel, scale
+
+def scale_coordinates(coords, scale):
+    """
+    Maps coordinates found on a skeleton produced at `scale` back to the
+    original image's pixel space, rounded to the nearest pixel, as int32.
+    """
+    coords = np.asarray(coords, dtype=np.float32)
+    if scale != 1.0:
+        coords = np.rint(coords / scale)
+    return coords.astype(np.int32)
+
+def _to_device(img):
+    """
+    Wraps an image in a UMat when OpenCL is available.
+    """
+    return cv2.UMat(img) if OPENCL_AVAILABLE else img
+
+def _to_host(result):
+    """
+    Downloads a UMat result back into an ndarray (None and ndarrays pass through).
+    """
+    return result.get() if isinstance(result, cv2.UMat) else result
+
+def classify_code(code):
+    """
+    Classifies a foreground pixel from its 8-bit neighbour code.
+    """
+    return POINT_TYPES[CATEGORY_LUT[code]]
 
 def classify_point(neighborhood):
     """
     Classifies a point as corner, endpoint, T-junction, or none.
     """
-    pattern = (neighborhood == 255).astype(int)
-    center = pattern[1,1]
-    if center == 0:
+    pattern = (neighborhood == 255)
+    if not pattern[1, 1]:
         return 'none'
-    
-    # Count neighbors
-    neighbors = np.sum(pattern) - center
-    
-    # 8 neighbors in clockwise order
-    pixels = [
-        pattern[0,1], pattern[0,2], pattern[1,2], pattern[2,2],
-        pattern[2,1], pattern[2,0], pattern[1,0], pattern[0,0]
-    ]
-    
-    # Count transitions from 0 to 1
-    transitions = 0
-    pixels.append(pixels[0])  # wrap-around
-    for i in range(8):
-        if pixels[i] == 0 and pixels[i+1] == 1:
-            transitions += 1
-    
-    # Logic
-    if neighbors == 1:
-        return 'endpoint'
-    elif transitions == 2:
-        if neighbors == 2:
-            return 'corner'
-        elif neighbors == 3:
-            return 't_junction'
-    
-    return 'none'
+
+    code = 0
+    for bit, (dy, dx) in enumerate(NEIGHBOR_OFFSETS):
+        code |= int(pattern[1 + dy, 1 + dx]) << bit
+    return classify_code(code)
+
+def classify_points(image, points):
+    """
+    Vectorized classify_point for many (x, y) points of a single-channel image.
+    Points on the image border are classified as 'none'.
+    Returns an array of CATEGORY_* values, one per point.
+    """
+    pts = np.asarray(points, dtype=np.intp).reshape(-1, 2)
+    h, w = image.shape[:2]
+    xs, ys = pts[:, 0], pts[:, 1]
+    inside = (xs > 0) & (xs < w - 1) & (ys > 0) & (ys < h - 1)
+    xs, ys = xs[inside], ys[inside]
+
+    codes = np.zeros(len(xs), dtype=np.uint8)
+    for bit, (dy, dx) in enumerate(NEIGHBOR_OFFSETS):
+        codes |= (image[ys + dy, xs + dx] == 255).astype(np.uint8) << np.uint8(bit)
+
+    categories = np.full(len(pts), CATEGORY_NONE, dtype=np.uint8)
+    categories[inside] = np.where(image[ys, xs] == 255, CATEGORY_LUT[codes], CATEGORY_NONE)
+    return categories
+
+def neighbor_codes(binary):
+    """
+    Packs the 8 neighbours of every interior pixel of a 0/1 uint8 image into
+    an 8-bit code (bit order given by NEIGHBOR_OFFSETS).
+    Returns a (H-2)×(W-2) uint8 array.
+    """
+    h, w = binary.shape
+    codes = np.zeros((max(h - 2, 0), max(w - 2, 0)), dtype=np.uint8)
+    # Shifted neighbour planes are strided views; a single scratch plane
+    # receives each shifted copy, so no per-neighbour temporaries are allocated
+    plane = np.empty_like(codes)
+    for bit, (dy, dx) in enumerate(NEIGHBOR_OFFSETS):
+        np.left_shift(binary[1 + dy:h - 1 + dy, 1 + dx:w - 1 + dx], bit, out=plane, dtype=np.uint8)
+        codes |= plane
+    return codes
+
+if NUMBA_AVAILABLE:
+    # Serial: it runs in every pipeline process, which must stay single-threaded
+    @njit(cache=True)
+    def _classify_image(skel, category_lut, dys, dxs, out):
+        """
+        Writes the category of every interior pixel of a 0/255 skeleton
+        into `out`, shape (H-2, W-2).
+        """
+        h, w = skel.shape
+        for y in range(1, h - 1):
+            for x in range(1, w - 1):
+                if skel[y, x] != 255:
+                    out[y - 1, x - 1] = CATEGORY_NONE
+                    continue
+                code = 0
+                for b in range(8):
+                    if skel[y + dys[b], x + dxs[b]] == 255:
+                        code |= 1 << b
+                out[y - 1, x - 1] = category_lut[code]
+
+def classify_image(skel):
+    """
+    Classifies every interior pixel of a 0/255 skeleton in one pass.
+    Returns an (H-2)×(W-2) uint8 array of CATEGORY_* values.
+    """
+    h, w = skel.shape
+    if NUMBA_AVAILABLE:
+        categories = np.empty((max(h - 2, 0), max(w - 2, 0)), dtype=np.uint8)
+        _classify_image(np.ascontiguousarray(skel), CATEGORY_LUT, _NEIGHBOR_DY, _NEIGHBOR_DX, categories)
+        return categories
+
+    binary = (skel == 255).view(np.uint8)
+    categories = CATEGORY_LUT[neighbor_codes(binary)]
+    categories[binary[1:-1, 1:-1] == 0] = CATEGORY_NONE
+    return categories
 
 def detect_corners(skel, max_corners=500, quality_level=0.001, min_distance=10):
     """
     Use cv2.goodFeaturesToTrack + classify_point to find corners, endpoints, T-junctions.
-    Returns a list of (x, y) points.
+    Returns an (N, 2) int32 array of (x, y) points.
     """
-    corners = cv2.goodFeaturesToTrack(
-        skel, 
+    corners = _to_host(cv2.goodFeaturesToTrack(
+        _to_device(skel), 
         maxCorners=max_corners, 
         qualityLevel=quality_level, 
         minDistance=min_distance, 
         blockSize=3
-    )
-    
-    important_points = []
-    if corners is not None:
-        corners = corners.astype(int)
-        for corner in corners:
-            x, y = corner.ravel()
-            # Check a 3×3 neighborhood
-            if 0 < y < skel.shape[0]-1 and 0 < x < skel.shape[1]-1:
-                neighborhood = skel[y-1:y+2, x-1:x+2]
-                point_type = classify_point(neighborhood)
-                if point_type != 'none':
-                    important_points.append([x, y])
-
-    # Additional pass for endpoints/T-junctions missed
-    height, width = skel.shape
-    for y in range(1, height-1):
-        for x in range(1, width-1):
-            if skel[y, x] == 255:
-                neighborhood = skel[y-1:y+2, x-1:x+2]
-                point_type = classify_point(neighborhood)
-                if point_type in ['endpoint', 't_junction']:
-                    # Avoid duplicates if already close
-                    if not any(abs(x - px) < min_distance and abs(y - py) < min_distance 
-                               for px, py in important_points):
-                        important_points.append([x, y])
+    ))
     
-    return important_points
+    important_points = np.empty((0, 2), dtype=np.int32)
+    if corners is not None and corners.size > 0:
+        corners = corners.reshape(-1, 2).astype(np.int32)
+        categories = classify_points(skel, corners)
+        important_points = corners[categories != CATEGORY_NONE]
+
+    # Additional pass for endpoints/T-junctions missed, over the whole image at once
+    categories = classify_image(skel)
+    missed = (categories == CATEGORY_ENDPOINT) | (categories == CATEGORY_T_JUNCTION)
+
+    # argwhere yields row-major order, i.e. the order of the old per-pixel scan
+    candidates = np.argwhere(missed)[:, ::-1] + 1
+
+    # Avoid duplicates if already close to a goodFeaturesToTrack point.
+    # Coordinates are integral, so "< min_distance" is "<= min_distance - 0.5".
+    radius = min_distance - 0.5
+    if len(important_points) > 0 and len(candidates) > 0:
+        tree = cKDTree(important_points)
+        dist, _ = tree.query(candidates, p=np.inf, distance_upper_bound=radius)
+        candidates = candidates[np.isinf(dist)]
+
+    # ...and to a candidate accepted earlier in the scan
+    if len(candidates) > 0:
+        neighbors = cKDTree(candidates).query_ball_point(candidates, r=radius, p=np.inf)
+        accepted = np.zeros(len(candidates), dtype=bool)
+        suppressed = np.zeros(len(candidates), dtype=bool)
+        for i, hits in enumerate(neighbors):
+            if not suppressed[i]:
+                accepted[i] = True
+                suppressed[hits] = True
+        candidates = candidates[accepted]
+
+    return np.concatenate([important_points, candidates.astype(np.int32)])
 
 def cluster_points(points, num_clusters=20):
     """
     Clusters corner points using KMeans, returning cluster centers (x, y).
+    Large problems go to FAISS when installed; otherwise scipy's kmeans2
+    is used.
     """
     if len(points) == 0:
         return []
 
-    points_arr = np.array(points, dtype=np.float32)
-    k = min(num_clusters, len(points_arr))
-    kmeans = KMeans(n_clusters=k, random_state=42).fit(points_arr)
-    return kmeans.cluster_centers_
+    points_arr = np.ascontiguousarray(points, dtype=np.float32)
+    # With no more points than clusters, every point is its own center
+    if len(points_arr) <= num_clusters:
+        return points_arr
+
+    k = num_clusters
+    if FAISS_AVAILABLE and len(points_arr) * k >= FAISS_MIN_WORK:
+        kmeans = faiss.Kmeans(points_arr.shape[1], k, niter=20, seed=42, verbose=False)
+        kmeans.train(points_arr)
+        return kmeans.centroids
+
+    # k-means++ seeding breaks down with fewer distinct points than clusters
+    distinct = np.unique(points_arr, axis=0)
+    if len(distinct) <= k:
+        return distinct
+    centers, _ = kmeans2(points_arr, k, iter=20, minit='++', seed=42)
+    return centers
 
 def fit_line_to_clustered_points(image, clustered_points, draw=True):
     """
@@ -180,47 +449,51 @@ def fit_line_to_clustered_points(image, clustered_points, draw=True):
     if not draw:
         return
 
-    h, w = image.shape[:2]
-
-    for (x_c, y_c) in clustered_points:
-        x_c = int(x_c)
-        y_c = int(y_c)
-
-        # Get 3×3 patch
-        y0, y1 = max(0, y_c - 1), min(h, y_c + 2)
-        x0, x1 = max(0, x_c - 1), min(w, x_c + 2)
-
-        neighborhood = image[y0:y1, x0:x1, 0]  # just the first channel
-        if neighborhood.shape[0] < 3 or neighborhood.shape[1] < 3:
-            point_type = 'none'
-        else:
-            point_type = classify_point(neighborhood)
+    points = np.asarray(clustered_points, dtype=int).reshape(-1, 2)
+    categories = classify_points(image[:, :, 0], points)  # just the first channel
+    stamp_points(image, points, CATEGORY_COLORS[categories])
 
-        if point_type == 'endpoint':
-            color = (255, 0, 0)   # Blue
-        elif point_type == 'corner':
-            color = (0, 0, 255)   # Red
-        elif point_type == 't_junction':
-            color = (0, 255, 0)   # Green
-        else:
-            color = (0, 165, 255) # Orange
-
-        cv2.circle(image, (x_c, y_c), 3, color, -1)
+def stamp_points(image, points, colors):
+    """
+    Draws a filled radius-3 dot (the pixels of cv2.circle) at every (x, y) point
+    with a single scatter write; where dots overlap, later points win.
+    """
+    h, w = image.shape[:2]
+    ys = points[:, 1, None] + DISK_OFFSETS[:, 0]
+    xs = points[:, 0, None] + DISK_OFFSETS[:, 1]
+    inside = (ys >= 0) & (ys < h) & (xs >= 0) & (xs < w)
+    point_colors = np.broadcast_to(colors[:, None, :], ys.shape + (3,))[inside]
+    ys, xs = ys[inside], xs[inside]
+    # NumPy leaves the order of repeated fancy-index writes unspecified, so
+    # keep only the last write to each pixel
+    _, last = np.unique((ys * w + xs)[::-1], return_index=True)
+    last = len(ys) - 1 - last
+    image[ys[last], xs[last]] = point_colors[last]
+
+def draw_lines(image, lines, color=(0, 255, 0), thickness=2):
+    """
+    Draws all (x1, y1, x2, y2) segments with a single cv2.polylines call.
+    """
+    if len(lines) == 0:
+        return
+    segments = np.asarray(lines, dtype=np.int32).reshape(-1, 2, 2)
+    cv2.polylines(image, segments, False, color, thickness)
 
 def detect_straight_walls_hough(skel, threshold=50, min_line_length=50, max_line_gap=10):
     """
     Hough transform for lines in the skeleton
     """
-    edges = cv2.Canny(skel, 50, 150, apertureSize=3)
-    lines = cv2.HoughLinesP(
+    # Edges stay on the device between Canny and HoughLinesP
+    edges = cv2.Canny(_to_device(skel), 50, 150, apertureSize=3)
+    lines = _to_host(cv2.HoughLinesP(
         edges, 
         rho=1, 
         theta=np.pi/180,
         threshold=threshold,
         minLineLength=min_line_length,
         maxLineGap=max_line_gap
-    )
-    if lines is None:
+    ))
+    if lines is None or lines.size == 0:
         return []
     return lines.reshape(-1, 4)
 
@@ -231,11 +504,14 @@ def main():
     parser.add_argument('input_image', help='Path to input image')
     parser.add_argument('--thresh_val', type=int, default=100, help='Binarization threshold')
     parser.add_argument('--clusters', type=int, default=20, help='Number of clusters for corner points')
+    parser.add_argument('--target_side', type=int, default=MAX_IMAGE_SIDE,
+                        help='Downscale so the longest side is at most this (0 = full resolution)')
     args = parser.parse_args()
 
     input_image_path = args.input_image
     thresh_val = args.thresh_val
     num_clusters = args.clusters
+    target_side = args.target_side
 
     # Ensure file exists
     if not os.path.exists(input_image_path):
@@ -243,7 +519,9 @@ def main():
         return
 
     # 1. Skeletonize
-    skel = skeletonize_image(input_image_path, thresh_val=thresh_val)
+    skel, scale = skeletonize_image(input_image_path, thresh_val=thresh_val, target_side=target_side)
+    if scale < 1.0:
+        print(f"Processing at {scale:.3f}× the original resolution.")
     output_dir = os.path.dirname(input_image_path) or '.'
 
     skel_output_path = os.path.join(output_dir, "skeletonized.png")
@@ -255,7 +533,7 @@ def main():
 
     # 3. KMeans cluster
     clustered_pts = cluster_points(corners, num_clusters=num_clusters)
-    print("Clustered corners:\n", clustered_pts)
+    print("Clustered corners (original resolution):\n", scale_coordinates(clustered_pts, scale))
 
     # 4. Convert to BGR, draw points
     skel_bgr = cv2.cvtColor(skel, cv2.COLOR_GRAY2BGR)
@@ -263,8 +541,7 @@ def main():
 
     # 5. Hough lines
     lines = detect_straight_walls_hough(skel)
-    for (x1, y1, x2, y2) in lines:
-        cv2.line(skel_bgr, (x1, y1), (x2, y2), (0, 255, 0), 2)
+    draw_lines(skel_bgr, lines)
 
     # 6. Save annotated
     clustered_output_path = os.path.join(output_dir, "clustered_points.png")
@@ -0,0 +1,30 @@
+# File: gunicorn.conf.py
+# Production server settings for app.py:
+#   gunicorn --config gunicorn.conf.py app:app
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# One process per core so concurrent uploads are processed in parallel;
+# a few threads each keep I/O-bound requests (uploads, static files) flowing
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Skeletonizing a large scan can take a while
+timeout = 120
+
+# Each worker imports the app itself: OpenCV's OpenCL state does not survive fork
+preload_app = False
+
+def post_fork(server, worker):
+    # Otherwise every worker spawns an OpenCV thread pool sized to all cores
+    import cv2
+    cv2.setNumThreads(1)
+
+def post_worker_init(worker):
+    # Spawn and warm this worker's pipeline pool (PIPELINE_PROCESSES processes)
+    # before it takes requests
+    from app import pipeline_pool
+    pipeline_pool.start()
@@ -0,0 +1,191 @@
+# File: pipeline.py
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+
+import cv2
+import numpy as np
+
+from caching import BoundedMemory
+from detect_floorplan import (
+    detect_corners,
+    cluster_points,
+    detect_straight_walls_hough
+)
+
+# Worker processes per PipelinePool (per gunicorn worker); override with
+# PIPELINE_PROCESSES. gunicorn already runs one worker per core, and each
+# warmed pipeline process holds ~200 MB, so one keeps the total near the core count
+PIPELINE_PROCESSES = int(os.environ.get('PIPELINE_PROCESSES', 1))
+
+# Seconds a request waits for its pipeline task before the pool is recycled
+PIPELINE_TIMEOUT = float(os.environ.get('PIPELINE_TIMEOUT', 100))
+
+# Disk budget of the KMeans result cache; override with KMEANS_CACHE_BYTES
+KMEANS_CACHE_BYTES = int(os.environ.get('KMEANS_CACHE_BYTES', 64 * 1024 * 1024))
+
+# Clustering function and its result cache (if any) of this worker process,
+# set up by _init_worker
+_cluster = cluster_points
+_kmeans_memory = None
+
+def run_stages(skel, num_clusters=20, cluster=cluster_points):
+    """
+    Corner detection -> clustering -> Hough lines on a skeleton.
+    Returns (corners, clustered_pts, lines). Errors are re-raised as
+    RuntimeError naming the stage that failed.
+    """
+    try:
+        corners = detect_corners(skel, max_corners=500, quality_level=0.001, min_distance=10)
+    except Exception as e:
+        raise RuntimeError(f"Corner detection failed: {str(e)}")
+
+    try:
+        clustered_pts = cluster(corners, num_clusters=num_clusters)
+    except Exception as e:
+        raise RuntimeError(f"Clustering failed: {str(e)}")
+
+    try:
+        lines = detect_straight_walls_hough(skel)
+    except Exception as e:
+        raise RuntimeError(f"Hough Transform failed: {str(e)}")
+
+    return corners, clustered_pts, lines
+
+def _init_worker(kmeans_cache_dir, kmeans_cache_bytes):
+    """
+    Pool initializer: configures the worker and runs every stage once on a
+    small dummy skeleton, so imports, OpenCV kernels and thread pools are
+    warm before the first request arrives.
+    """
+    global _cluster, _kmeans_memory
+    cv2.setNumThreads(1)
+    if kmeans_cache_dir:
+        _kmeans_memory = BoundedMemory(kmeans_cache_dir, bytes_limit=kmeans_cache_bytes)
+        _cluster = _kmeans_memory.cache(cluster_points)
+
+    dummy = np.zeros((64, 64), dtype=np.uint8)
+    cv2.rectangle(dummy, (8, 8), (55, 55), 255, 1)
+    cv2.line(dummy, (8, 32), (55, 32), 255, 1)
+    run_stages(dummy, num_clusters=4)
+
+def _ready():
+    """
+    No-op task used by PipelinePool.start to wait for warmed-up workers.
+    """
+    return os.getpid()
+
+# Shared segments start with an int64 header holding the pid of the worker
+# that picked the task up (0 until then), followed by the skeleton
+_SHM_HEADER_BYTES = 8
+
+def _run_shared(shm_name, shape, dtype, num_clusters):
+    """
+    Pool task: runs the stages on a skeleton published in shared memory.
+    """
+    shm = SharedMemory(name=shm_name)
+    try:
+        np.ndarray((1,), dtype=np.int64, buffer=shm.buf)[0] = os.getpid()
+        # Copy out and detach right away, so no view (e.g. one held by an
+        # exception traceback) outlives the mapping
+        skel = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=_SHM_HEADER_BYTES).copy()
+    finally:
+        shm.close()
+    result = run_stages(skel, num_clusters=num_clusters, cluster=_cluster)
+    if _kmeans_memory is not None:
+        _kmeans_memory.maybe_trim()
+    return result
+
+class PipelinePool:
+    """
+    Persistent pool of pre-warmed processes running run_stages.
+    Skeletons are handed over through shared memory instead of being pickled.
+
+    The pool uses the 'spawn' start method: OpenCV's OpenCL state does not
+    survive fork. Call start() at server process start-up to pay for
+    spawning and warm-up there; otherwise the first request does.
+    If a task overruns `timeout`, the process running it is killed. Either
+    way a dead worker breaks the whole ProcessPoolExecutor: every other task
+    in flight on this pool (up to one per request thread) fails as well, and
+    the next call starts a fresh pool. Failed requests get a RuntimeError.
+    """
+    def __init__(self, processes=PIPELINE_PROCESSES, kmeans_cache_dir=None,
+                 kmeans_cache_bytes=KMEANS_CACHE_BYTES, timeout=PIPELINE_TIMEOUT):
+        self.processes = processes
+        self.kmeans_cache_dir = kmeans_cache_dir
+        self.kmeans_cache_bytes = kmeans_cache_bytes
+        self.timeout = timeout
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.kmeans_cache_dir, self.kmeans_cache_bytes)
+                )
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def start(self, processes=None):
+        """
+        Starts the pool, with `processes` workers if given, and blocks until every
+        worker has run its warm-up.
+        """
+        if processes is not None:
+            self.processes = processes
+        pool = self._get_pool()
+        # Each task submitted while no worker is idle spawns a new worker
+        futures = [pool.submit(_ready) for _ in range(self.processes)]
+        for future in futures:
+            future.result()
+
+    def _discard_pool(self, pool):
+        """
+        Drops a broken pool (its executor has already stopped the remaining
+        workers); the next call starts a new one.
+        """
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False)
+
+    def run(self, skel, num_clusters=20):
+        """
+        Runs run_stages on `skel` in a worker process.
+        Returns (corners, clustered_pts, lines).
+        """
+        pool = self._get_pool()
+        shm = SharedMemory(create=True, size=_SHM_HEADER_BYTES + skel.nbytes)
+        unlinked = False
+        try:
+            np.ndarray((1,), dtype=np.int64, buffer=shm.buf)[0] = 0
+            np.ndarray(skel.shape, dtype=skel.dtype, buffer=shm.buf, offset=_SHM_HEADER_BYTES)[...] = skel
+            try:
+                future = pool.submit(_run_shared, shm.name, skel.shape, skel.dtype.str, num_clusters)
+                return future.result(timeout=self.timeout)
+            except BrokenProcessPool:
+                self._discard_pool(pool)
+                raise RuntimeError("Floorplan pipeline worker crashed or was killed")
+            except FutureTimeoutError:
+                # A task that has not started yet fails once its segment is gone
+                shm.unlink()
+                unlinked = True
+                worker_pid = int(np.ndarray((1,), dtype=np.int64, buffer=shm.buf)[0])
+                if worker_pid and not future.done():
+                    # Stuck in a worker: kill that process, which breaks the pool
+                    os.kill(worker_pid, signal.SIGKILL)
+                    self._discard_pool(pool)
+                raise RuntimeError(f"Floorplan pipeline timed out after {self.timeout:g} s")
+        finally:
+            shm.close()
+            if not unlinked:
+                shm.unlink()